@@ -9,6 +9,8 @@ import os
 from datetime import datetime, timedelta
 import random
 
+from writer import MICROS_PER_USD, ModelIds, cost_micros, write_usage
+
 DATABASE_PATH = os.getenv("DATABASE_PATH", "./data/llmscope.db")
 
 # Sample usage patterns (provider, model, typical prompt/completion tokens)
@@ -28,20 +30,18 @@ USAGE_PATTERNS = [
 ]
 
 def calculate_cost(provider, model, prompt_tokens, completion_tokens, conn):
-    """Calculate cost based on pricing data."""
+    """Calculate cost in micro-dollars based on pricing data."""
     cursor = conn.cursor()
     cursor.execute("""
-        SELECT input_cost_per_1k, output_cost_per_1k
-        FROM model_pricing
-        WHERE provider = ? AND model = ?
+        SELECT p.input_micros_per_1m, p.output_micros_per_1m
+        FROM model_pricing p JOIN models m ON m.id = p.model_id
+        WHERE m.provider = ? AND m.model = ?
     """, (provider, model))
 
     result = cursor.fetchone()
     if result:
-        input_cost = (prompt_tokens / 1000) * result[0]
-        output_cost = (completion_tokens / 1000) * result[1]
-        return input_cost + output_cost
-    return 0.0
+        return cost_micros(prompt_tokens, completion_tokens, *result)
+    return 0
 
 def add_sample_data(num_records=100):
     """Add sample usage data to the database."""
@@ -54,6 +54,7 @@ def add_sample_data(num_records=100):
 
     now = datetime.now()
     added = 0
+    model_ids = ModelIds()
 
     for i in range(num_records):
         # Pick a random usage pattern
@@ -62,10 +63,8 @@ def add_sample_data(num_records=100):
         # Add some randomness to token counts (±30%)
         prompt_tokens = int(base_prompt * random.uniform(0.7, 1.3))
         completion_tokens = int(base_completion * random.uniform(0.7, 1.3))
-        total_tokens = prompt_tokens + completion_tokens
-
         # Calculate cost
-        cost_usd = calculate_cost(provider, model, prompt_tokens, completion_tokens, conn)
+        cost = calculate_cost(provider, model, prompt_tokens, completion_tokens, conn)
 
         # Generate timestamp (spread over last 7 days)
         days_ago = random.uniform(0, 7)
@@ -74,22 +73,17 @@ def add_sample_data(num_records=100):
         # Generate random request ID
         request_id = f"req_{provider}_{i:05d}"
 
-        # Insert record
-        cursor.execute("""
-            INSERT INTO api_usage
-            (provider, model, timestamp, prompt_tokens, completion_tokens, total_tokens, cost_usd, request_id, metadata)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            provider,
-            model,
-            timestamp,
-            prompt_tokens,
-            completion_tokens,
-            total_tokens,
-            cost_usd,
-            request_id,
-            '{"source": "sample_data"}'
-        ))
+        # Insert record (keeps the daily rollup in step)
+        write_usage(conn, {
+            "provider": provider,
+            "model": model,
+            "timestamp": timestamp,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cost_micros": cost,
+            "request_id": request_id,
+            "metadata": {"source": "sample_data"}
+        }, model_ids)
         added += 1
 
     conn.commit()
@@ -98,15 +92,15 @@ def add_sample_data(num_records=100):
     print(f"\n✅ Sample Data Added Successfully!")
     print(f"   📊 Records added: {added}")
 
-    # Show cost summary
-    cursor.execute("""
+    # Show cost summary (from the exact daily rollup; raw rows may be sampled)
+    cursor.execute(f"""
         SELECT
-            provider,
-            COUNT(*) as requests,
-            SUM(total_tokens) as total_tokens,
-            SUM(cost_usd) as total_cost
-        FROM api_usage
-        GROUP BY provider
+            m.provider,
+            SUM(d.request_count) as requests,
+            SUM(d.total_tokens) as total_tokens,
+            SUM(d.total_cost_micros) / {MICROS_PER_USD}.0 as total_cost
+        FROM usage_daily d JOIN models m ON m.id = d.model_id
+        GROUP BY m.provider
         ORDER BY total_cost DESC
     """)
 
@@ -119,14 +113,14 @@ def add_sample_data(num_records=100):
     print(f"\n   {'TOTAL':12} {added:3} requests  {'':7}         ${total_cost:.4f}")
 
     # Show most expensive models
-    cursor.execute("""
+    cursor.execute(f"""
         SELECT
-            provider,
-            model,
-            COUNT(*) as requests,
-            SUM(cost_usd) as total_cost
-        FROM api_usage
-        GROUP BY provider, model
+            m.provider,
+            m.model,
+            SUM(d.request_count) as requests,
+            SUM(d.total_cost_micros) / {MICROS_PER_USD}.0 as total_cost
+        FROM usage_daily d JOIN models m ON m.id = d.model_id
+        GROUP BY d.model_id
         ORDER BY total_cost DESC
         LIMIT 5
     """)
@@ -0,0 +1,109 @@
+"""
+LLMscope - Model Alias Resolution
+Maps the model names real traffic reports (dated snapshots, Ollama tags,
+dashed version numbers) onto the names in model_pricing. The rules compile
+into a per-provider trie, so resolving a name is linear in its length, and
+results are memoized until pricing changes.
+"""
+
+import re
+
+# Suffixes that pin a snapshot of a priced model
+_SNAPSHOT_SUFFIXES = [
+    re.compile(r"[-@]\d{4}-\d{2}-\d{2}$"),  # gpt-4o-2024-08-06
+    re.compile(r"[-@]\d{8}$"),              # claude-3-5-sonnet-20240620, @20240620
+    re.compile(r"-\d{4}$"),                 # gpt-4-0613
+    re.compile(r"-latest$"),
+]
+_OLLAMA_TAG = re.compile(r":[^:/]+$")       # llama3.1:8b
+_DASHED_VERSION = re.compile(r"(?<=\d)-(?=\d(?:-|$))")  # claude-3-5 -> claude-3.5
+
+# Characters that may follow a priced name when matching by prefix. "." is
+# left out: it continues a version number (gpt-4.1 is not gpt-4).
+_BOUNDARY = set("-:_@/ ")
+
+# Memoized lookups kept per compiled resolver
+MEMO_SIZE = 10000
+
+
+def normalize(model: str) -> str:
+    """Strip snapshot dates and tags and canonicalize version numbers."""
+    name = model.strip().lower()
+    name = _OLLAMA_TAG.sub("", name)
+    for suffix in _SNAPSHOT_SUFFIXES:
+        name = suffix.sub("", name)
+    return _DASHED_VERSION.sub(".", name)
+
+
+class _Node:
+    __slots__ = ("children", "model")
+
+    def __init__(self):
+        self.children = {}
+        self.model = None
+
+
+class ModelResolver:
+    """Resolve (provider, model) to a model_pricing entry.
+
+    Lookup order: exact name, explicit alias, normalized name, then the
+    longest priced name that is a prefix of the normalized name and ends at
+    a separator (so "gpt-4o-audio" matches "gpt-4o", never "gpt-4").
+    """
+
+    def __init__(self, pricing, aliases=()):
+        self.pricing = pricing  # (provider, model) -> (input_micros_per_1m, output_micros_per_1m)
+        self._aliases = {}
+        self._tries = {}
+        self._memo = {}
+
+        # The trie is keyed like lookups are, so a priced "claude-3-5-haiku"
+        # also matches "claude-3-5-haiku-20241022"
+        for provider, model in pricing:
+            self._insert(provider, normalize(model), model)
+        for provider, alias, model in aliases:
+            if (provider, model) in pricing:
+                self._aliases[(provider, alias)] = model
+                self._aliases.setdefault((provider, normalize(alias)), model)
+
+    def _insert(self, provider, key, model):
+        node = self._tries.setdefault(provider, _Node())
+        for char in key:
+            node = node.children.setdefault(char, _Node())
+        # When two priced names normalize alike, the one already in canonical form wins
+        if node.model is None or model.lower() == key:
+            node.model = model
+
+    def _longest_prefix(self, provider, name):
+        node = self._tries.get(provider)
+        best = None
+        for i, char in enumerate(name):
+            node = node.children.get(char) if node else None
+            if node is None:
+                break
+            if node.model is not None and (i + 1 == len(name) or name[i + 1] in _BOUNDARY):
+                best = node.model
+        return best
+
+    def _resolve(self, provider, model):
+        if (provider, model) in self.pricing:
+            return model
+        alias = self._aliases.get((provider, model))
+        if alias:
+            return alias
+
+        name = normalize(model)
+        alias = self._aliases.get((provider, name))
+        if alias:
+            return alias
+        return self._longest_prefix(provider, name)
+
+    def resolve(self, provider, model):
+        """Return (priced_model, (input_micros_per_1m, output_micros_per_1m)), or None."""
+        key = (provider, model)
+        if key not in self._memo:
+            if len(self._memo) >= MEMO_SIZE:
+                self._memo.clear()
+            priced = self._resolve(provider, model)
+            self._memo[key] = (priced, self.pricing[(provider, priced)]) if priced else None
+        return self._memo[key]
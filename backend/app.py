@@ -3,52 +3,73 @@ LLMscope - LLM Cost Dashboard Backend
 A self-hosted dashboard that shows LLM API costs in real-time and recommends cheaper models.
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Dict, Any
+from fastapi.responses import Response
+from typing import Dict, Any, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import asyncio
+import contextvars
 import sqlite3
 import os
 import datetime
 import json
 
+import aliases
+import forecast
+import formats
+import profiling
+import shards
+import tokens
+import writer
+
 # === CONFIGURATION ==========================================================
 DATABASE_PATH = os.getenv("DATABASE_PATH", "./data/llmscope.db")
 API_KEY = os.getenv("LLMSCOPE_API_KEY", "dev-123")
 
+# Multi-process mode: with more than one worker, a dedicated writer process
+# owns all writes and workers hand records to it over this Unix socket.
+WORKERS = int(os.getenv("LLMSCOPE_WORKERS", "1"))
+WRITER_SOCKET = os.getenv("LLMSCOPE_WRITER_SOCKET")
+
+# Estimate missing token counts from the logged prompt/response text
+COUNT_TOKENS = os.getenv("LLMSCOPE_COUNT_TOKENS", "false").lower() == "true"
+TOKEN_WORKERS = int(os.getenv("LLMSCOPE_TOKEN_WORKERS", "0")) or None
+TOKEN_CACHE_SIZE = int(os.getenv("LLMSCOPE_TOKEN_CACHE_SIZE", "10000"))
+# Keep the raw prompt/response text alongside each usage record
+STORE_TEXT = os.getenv("LLMSCOPE_STORE_TEXT", "false").lower() == "true"
+
+# Multi-tenant storage: a tenant named by this header, or mapped from the
+# request's API key, gets its own SQLite shard under LLMSCOPE_TENANTS_DIR.
+TENANT_HEADER = os.getenv("LLMSCOPE_TENANT_HEADER", "X-LLMscope-Tenant")
+TENANT_KEYS = json.loads(os.getenv("LLMSCOPE_TENANT_KEYS", "{}"))  # {"api-key": "tenant"}
+# Threads used to query shards in parallel for cross-tenant reports
+FANOUT_WORKERS = int(os.getenv("LLMSCOPE_FANOUT_WORKERS", "8"))
+
 # ============================================================================
 
 def init_db():
     """Initialize database for cost tracking."""
     os.makedirs(os.path.dirname(DATABASE_PATH) or ".", exist_ok=True)
     conn = sqlite3.connect(DATABASE_PATH)
+    # WAL lets readers in every worker proceed while the writer commits
+    conn.execute("PRAGMA journal_mode=WAL")
     c = conn.cursor()
 
-    # Cost tracking table
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS api_usage (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            provider TEXT NOT NULL,
-            model TEXT NOT NULL,
-            timestamp TEXT NOT NULL,
-            prompt_tokens INTEGER,
-            completion_tokens INTEGER,
-            total_tokens INTEGER,
-            cost_usd REAL,
-            request_id TEXT,
-            metadata TEXT
-        )
-    """)
+    # Usage tables (models, api_usage, usage_text, usage_daily)
+    writer.create_usage_tables(c)
 
     # Model pricing table
+    writer.create_pricing_table(c)
+
+    # Extra names that price as an existing model_pricing entry
     c.execute("""
-        CREATE TABLE IF NOT EXISTS model_pricing (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+        CREATE TABLE IF NOT EXISTS model_aliases (
             provider TEXT NOT NULL,
+            alias TEXT NOT NULL,
             model TEXT NOT NULL,
-            input_cost_per_1k REAL NOT NULL,
-            output_cost_per_1k REAL NOT NULL,
-            last_updated TEXT NOT NULL,
-            UNIQUE(provider, model)
+            PRIMARY KEY (provider, alias)
         )
     """)
 
@@ -63,14 +84,128 @@ def init_db():
 
     conn.commit()
     conn.close()
+    # Readers open shards read-only, so older shards are migrated here
+    writer.tenant_shards.migrate()
+    writer.bump_cache_generation(DATABASE_PATH)
     print(f"✓ Database initialized at {DATABASE_PATH}")
 
 def get_db():
     """Get database connection."""
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = sqlite3.connect(DATABASE_PATH, factory=profiling.connection_factory())
     conn.row_factory = sqlite3.Row
     return conn
 
+# === TENANTS ================================================================
+
+fanout_pool = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
+# Read-only shard handles; writes go through writer.tenant_shards
+tenant_readers = shards.ShardManager(shards.TENANTS_DIR, writer.create_usage_tables, readonly=True)
+
+def get_tenant(request: Request) -> Optional[str]:
+    """Resolve the request's tenant, or None for the default database."""
+    auth = request.headers.get("authorization", "")
+    if auth.startswith("Bearer ") and auth[7:] in TENANT_KEYS:
+        tenant = TENANT_KEYS[auth[7:]]
+    else:
+        tenant = request.headers.get(TENANT_HEADER)
+    if tenant and not shards.valid_tenant(tenant):
+        raise HTTPException(status_code=400, detail="Tenant names may only contain letters, digits, '-' and '_'")
+    return tenant or None
+
+def is_admin(request: Request) -> bool:
+    return request.headers.get("authorization") == f"Bearer {API_KEY}"
+
+def require_admin(request: Request):
+    """Reject requests that don't carry the main LLMSCOPE_API_KEY."""
+    if not is_admin(request):
+        raise HTTPException(status_code=403, detail="Admin API key required")
+
+def tenant_scope(request: Request, tenant: Optional[str], all_tenants: bool) -> List[Optional[str]]:
+    """Tenants a report covers: the caller's own, or every shard for admins."""
+    if not all_tenants:
+        return [tenant]
+    require_admin(request)
+    return [None] + tenant_readers.tenants()
+
+@contextmanager
+def tenant_db(tenant: Optional[str]):
+    """Connection to a tenant's shard, or to the default database."""
+    if tenant is None:
+        conn = get_db()
+        try:
+            yield conn
+        finally:
+            conn.close()
+    else:
+        with tenant_readers.connect(tenant) as conn:
+            yield conn
+
+def _query_tenant(tenant, query, params):
+    with tenant_db(tenant) as conn:
+        return [tuple(row) for row in conn.execute(query, params).fetchall()]
+
+async def query_tenants(tenants: List[Optional[str]], query: str, params=()):
+    """Run a read-only query on every tenant's database in parallel."""
+    loop = asyncio.get_running_loop()
+    # Each shard query carries the request's context (e.g. profiling state)
+    return await asyncio.gather(*(
+        loop.run_in_executor(fanout_pool, contextvars.copy_context().run, _query_tenant, tenant, query, params)
+        for tenant in tenants
+    ))
+
+# === WRITES & CACHES ========================================================
+
+# Set on startup: a WriterClient when a writer process owns the database,
+# otherwise a LocalWriter that batches this process's writes the same way
+writer_client = None
+
+async def submit_write(op: str, data: Any):
+    """Apply a write through the writer process or the in-process batcher."""
+    return await writer_client.submit(op, data)
+
+class GenerationCache:
+    """Cached value reloaded whenever another process bumps the cache generation."""
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._generation = object()
+        self._value = None
+
+    def get(self):
+        generation = writer.cache_generation(DATABASE_PATH)
+        if generation is None or generation != self._generation:
+            self._value = self._loader()
+            self._generation = generation
+        return self._value
+
+def _load_pricing():
+    conn = get_db()
+    cursor = conn.execute("""
+        SELECT m.provider, m.model, p.input_micros_per_1m, p.output_micros_per_1m
+        FROM model_pricing p JOIN models m ON m.id = p.model_id
+    """)
+    pricing = {(row["provider"], row["model"]): (row["input_micros_per_1m"], row["output_micros_per_1m"])
+               for row in cursor.fetchall()}
+    cursor = conn.execute("SELECT provider, alias, model FROM model_aliases")
+    model_aliases = [tuple(row) for row in cursor.fetchall()]
+    conn.close()
+    return aliases.ModelResolver(pricing, model_aliases)
+
+def _load_settings():
+    conn = get_db()
+    cursor = conn.execute("SELECT key, value FROM settings")
+    settings = {row["key"]: json.loads(row["value"]) for row in cursor.fetchall()}
+    conn.close()
+    return settings
+
+pricing_cache = GenerationCache(_load_pricing)
+settings_cache = GenerationCache(_load_settings)
+
+token_counter = tokens.TokenCounter(max_workers=TOKEN_WORKERS, cache_size=TOKEN_CACHE_SIZE)
+
+# Forecasts only use complete days, so they stay valid until the date rolls over
+forecast_cache = {"day": None, "results": {}}
+
 # Initialize FastAPI
 app = FastAPI(
     title="LLMscope Cost Dashboard",
@@ -87,10 +222,52 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def compress_response(request: Request, call_next):
+    """Compress large responses with brotli or gzip."""
+    response = await call_next(request)
+    encoding = formats.choose_encoding(request.headers.get("accept-encoding"))
+    if encoding is None or "content-encoding" in response.headers:
+        return response
+
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    headers = {k: v for k, v in response.headers.items() if k.lower() != "content-length"}
+    headers["vary"] = "Accept-Encoding"
+    if len(body) >= formats.MIN_COMPRESS_SIZE:
+        # Large pages compress off the event loop
+        body = await asyncio.to_thread(formats.compress, body, encoding)
+        headers["content-encoding"] = encoding
+    return Response(body, status_code=response.status_code, headers=headers)
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    """Profile sampled requests and admin requests that ask for it."""
+    requested = request.headers.get(profiling.PROFILE_HEADER, "").lower() in ("1", "true") and is_admin(request)
+    if not profiling.wants_profile(requested):
+        return await call_next(request)
+    return await profiling.profile_request(request, call_next)
+
 # Initialize database on startup
 @app.on_event("startup")
 async def startup_event():
-    init_db()
+    global writer_client
+    if WRITER_SOCKET:
+        # The writer process created the schema before workers started
+        writer_client = writer.WriterClient(WRITER_SOCKET)
+    else:
+        init_db()
+        writer_client = writer.LocalWriter(DATABASE_PATH)
+        await writer_client.start()
+    if COUNT_TOKENS:
+        token_counter.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if isinstance(writer_client, writer.LocalWriter):
+        await writer_client.close()
+    token_counter.shutdown()
+    tenant_readers.close_all()
+    writer.tenant_shards.close_all()
 
 # ============================================================================
 # API ENDPOINTS
@@ -107,93 +284,289 @@ async def root():
 
 @app.get("/api/usage")
 async def get_usage(
+    request: Request,
+    tenant: Optional[str] = Depends(get_tenant),
     limit: int = 100,
     provider: str = None,
-    model: str = None
+    model: str = None,
+    format: str = None
 ):
-    """Get API usage history."""
+    """Get API usage history.
+
+    Rows are returned as JSON objects by default; `format` (or the Accept
+    header) selects columnar JSON, MessagePack or Arrow IPC instead.
+    """
     # Validate limit
     if limit < 1 or limit > 10000:
         raise HTTPException(status_code=400, detail="Limit must be between 1 and 10000")
+    try:
+        fmt = formats.negotiate(format, request.headers.get("accept"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     try:
-        conn = get_db()
-        query = "SELECT * FROM api_usage WHERE 1=1"
+        # Costs are stored as integer micro-dollars and converted only here;
+        # rows reference models by ID, so names come from the join
+        query = """
+            SELECT u.id, m.provider, m.model, u.timestamp, u.prompt_tokens, u.completion_tokens,
+                   u.total_tokens, u.cost_micros / 1000000.0 AS cost_usd, u.request_id, u.metadata,
+                   u.sample_rate
+            FROM api_usage u JOIN models m ON m.id = u.model_id WHERE 1=1
+        """
         params = []
 
         if provider:
-            query += " AND provider = ?"
+            query += " AND m.provider = ?"
             params.append(provider)
         if model:
-            query += " AND model = ?"
+            query += " AND m.model = ?"
             params.append(model)
 
-        query += " ORDER BY timestamp DESC LIMIT ?"
+        query += " ORDER BY u.timestamp DESC LIMIT ?"
         params.append(limit)
 
-        cursor = conn.execute(query, params)
-        usage = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-
-        # Round costs to avoid floating point precision issues
-        for item in usage:
-            if item.get("cost_usd"):
-                item["cost_usd"] = round(item["cost_usd"], 6)
-
-        return {"usage": usage, "count": len(usage)}
+        with tenant_db(tenant) as conn:
+            cursor = conn.execute(query, params)
+            cursor.row_factory = None
+            rows = cursor.fetchall()
+            names = [column[0] for column in cursor.description]
 
     except Exception as e:
-        if 'conn' in locals():
-            conn.close()
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
-@app.get("/api/costs/summary")
-async def get_cost_summary():
-    """Get cost summary by provider and model."""
     try:
-        conn = get_db()
+        return formats.render(fmt, names, rows, {
+            "count": len(rows),
+            # Raw rows are a sample; use /api/costs/summary for exact totals
+            "sampled": writer.RAW_SAMPLE_RATE < 1,
+            "sample_rate": writer.RAW_SAMPLE_RATE
+        })
+    except LookupError as e:
+        raise HTTPException(status_code=406, detail=str(e))
 
-        # Total costs
-        cursor = conn.execute("""
-            SELECT
-                provider,
-                model,
-                SUM(cost_usd) as total_cost,
-                SUM(total_tokens) as total_tokens,
-                COUNT(*) as request_count
-            FROM api_usage
-            GROUP BY provider, model
-            ORDER BY total_cost DESC
+@app.get("/api/costs/summary")
+async def get_cost_summary(
+    request: Request,
+    tenant: Optional[str] = Depends(get_tenant),
+    all_tenants: bool = False
+):
+    """Get cost summary by provider and model.
+
+    With all_tenants=true (admin key required) every shard is queried in
+    parallel and the partial sums are merged.
+    """
+    tenants = tenant_scope(request, tenant, all_tenants)
+    try:
+        # Total costs (the daily rollup is exact even when raw rows are sampled)
+        partials = await query_tenants(tenants, """
+            SELECT m.provider, m.model, t.total_cost_micros, t.total_tokens, t.request_count
+            FROM (
+                SELECT
+                    model_id,
+                    SUM(total_cost_micros) as total_cost_micros,
+                    SUM(total_tokens) as total_tokens,
+                    SUM(request_count) as request_count
+                FROM usage_daily
+                GROUP BY model_id
+            ) t JOIN models m ON m.id = t.model_id
         """)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
-        summary = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+    merged = {}
+    for rows in partials:
+        for provider, model, total_cost_micros, total_tokens, request_count in rows:
+            item = merged.setdefault((provider, model), [0, 0, 0])
+            item[0] += total_cost_micros
+            item[1] += total_tokens
+            item[2] += request_count
+
+    # Integer micro-dollar sums are exact; convert to dollars for the response
+    summary = [
+        {"provider": provider, "model": model, "total_cost": total_cost_micros / writer.MICROS_PER_USD,
+         "total_tokens": total_tokens, "request_count": request_count}
+        for (provider, model), (total_cost_micros, total_tokens, request_count) in merged.items()
+    ]
+    summary.sort(key=lambda item: item["total_cost"], reverse=True)
+
+    return {"summary": summary}
+
+@app.get("/api/costs/forecast")
+async def get_cost_forecast(
+    request: Request,
+    tenant: Optional[str] = Depends(get_tenant),
+    all_tenants: bool = False,
+    history_days: int = 56,
+    confidence: float = 0.95
+):
+    """Project month-end spend per provider and model from daily aggregates."""
+    if history_days < 31 or history_days > 365:
+        raise HTTPException(status_code=400, detail="history_days must be between 31 and 365")
+    if confidence <= 0 or confidence >= 1:
+        raise HTTPException(status_code=400, detail="confidence must be between 0 and 1")
+
+    today = datetime.datetime.utcnow().date()
+    if forecast_cache["day"] != today:
+        forecast_cache["day"] = today
+        forecast_cache["results"] = {}
+
+    tenants = tenant_scope(request, tenant, all_tenants)
+    key = ("*" if all_tenants else tenant, history_days, confidence)
+    if key not in forecast_cache["results"]:
+        start = today - datetime.timedelta(days=history_days)
+        try:
+            partials = await query_tenants(tenants, """
+                SELECT d.day, m.provider, m.model, d.total_cost_micros / 1000000.0
+                FROM usage_daily d JOIN models m ON m.id = d.model_id
+                WHERE d.day >= ? AND d.day < ?
+            """, (start.isoformat(), today.isoformat()))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+        rows = [row for rows in partials for row in rows]
+
+        forecast_cache["results"][key] = {
+            "as_of": today.isoformat(),
+            "history_days": history_days,
+            "confidence": confidence,
+            **forecast.forecast_month_end(rows, today, history_days, confidence)
+        }
+
+    return forecast_cache["results"][key]
 
-        # Round costs to avoid floating point precision issues
-        for item in summary:
-            if item.get("total_cost"):
-                item["total_cost"] = round(item["total_cost"], 6)
+@app.get("/api/costs/top")
+async def get_top_costs(
+    request: Request,
+    key: str,
+    window: str = "24h",
+    k: int = 10,
+    tenant: Optional[str] = Depends(get_tenant),
+    all_tenants: bool = False
+):
+    """Get the highest-cost values of a metadata key (user, API key, ...).
 
-        return {"summary": summary}
+    Only the caller's tenant is covered; all_tenants=true (admin key
+    required) merges every tenant's sketches.
+    """
+    if k < 1 or k > 100:
+        raise HTTPException(status_code=400, detail="k must be between 1 and 100")
 
+    tenants = tenant_scope(request, tenant, all_tenants)
+    query = {"key": key, "window": window, "k": k, "tenants": tenants}
+    try:
+        top = await writer_client.submit("top", query)
     except Exception as e:
-        if 'conn' in locals():
-            conn.close()
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Top-K error: {str(e)}")
+    if top is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Not tracking '{key}' over '{window}' (see LLMSCOPE_TOPK_KEYS / LLMSCOPE_TOPK_WINDOWS)"
+        )
+
+    return {
+        "key": key,
+        "window": window,
+        "top": top,
+        "capacity": writer.heavy_hitters.capacity,
+    }
 
 @app.get("/api/models/pricing")
 async def get_model_pricing():
     """Get current model pricing data."""
     conn = get_db()
-    cursor = conn.execute("SELECT * FROM model_pricing ORDER BY provider, model")
+    cursor = conn.execute("""
+        SELECT p.id, m.provider, m.model,
+               p.input_micros_per_1m / 1e9 AS input_cost_per_1k,
+               p.output_micros_per_1m / 1e9 AS output_cost_per_1k,
+               p.last_updated
+        FROM model_pricing p JOIN models m ON m.id = p.model_id
+        ORDER BY m.provider, m.model
+    """)
     pricing = [dict(row) for row in cursor.fetchall()]
     conn.close()
 
     return {"pricing": pricing, "count": len(pricing)}
 
+@app.post("/api/models/pricing")
+async def update_model_pricing(pricing: List[Dict[str, Any]]):
+    """Add or update model pricing."""
+    timestamp = datetime.datetime.utcnow().isoformat()
+    rows = []
+    for entry in pricing:
+        try:
+            rows.append({
+                "provider": entry["provider"],
+                "model": entry["model"],
+                "input_micros_per_1m": writer.price_to_micros(float(entry["input_cost_per_1k"])),
+                "output_micros_per_1m": writer.price_to_micros(float(entry["output_cost_per_1k"])),
+                "last_updated": timestamp
+            })
+        except KeyError as e:
+            raise HTTPException(status_code=400, detail=f"Missing required field: {e.args[0]}")
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Costs must be valid numbers")
+
+    try:
+        result = await submit_write("pricing", rows)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    return {"status": "updated", "count": result["count"]}
+
+@app.get("/api/models/aliases")
+async def get_model_aliases():
+    """Get explicit model aliases."""
+    conn = get_db()
+    cursor = conn.execute("SELECT provider, alias, model FROM model_aliases ORDER BY provider, alias")
+    model_aliases = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+
+    return {"aliases": model_aliases, "count": len(model_aliases)}
+
+@app.post("/api/models/aliases")
+async def update_model_aliases(model_aliases: List[Dict[str, str]]):
+    """Map extra model names onto priced models."""
+    rows = []
+    for entry in model_aliases:
+        if not all(entry.get(field) for field in ("provider", "alias", "model")):
+            raise HTTPException(status_code=400, detail="Each alias needs provider, alias and model")
+        rows.append({"provider": entry["provider"], "alias": entry["alias"], "model": entry["model"]})
+
+    try:
+        result = await submit_write("aliases", rows)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    return {"status": "updated", "count": result["count"]}
+
+def parse_timestamp(value) -> str:
+    """Return value as a naive UTC ISO-8601 string; None means now.
+
+    Accepts ISO-8601 strings (offsets are converted to UTC) and Unix epoch
+    seconds.
+    """
+    if value is None:
+        return datetime.datetime.utcnow().isoformat()
+    if isinstance(value, bool):
+        raise TypeError("timestamp must not be a boolean")
+    if isinstance(value, (int, float)):
+        return datetime.datetime.utcfromtimestamp(value).isoformat()
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed.isoformat()
+
 @app.post("/api/usage")
-async def log_usage(usage: Dict[str, Any]):
+async def log_usage(usage: Dict[str, Any], tenant: Optional[str] = Depends(get_tenant)):
     """Log API usage and calculate cost."""
+    # Estimate token counts the client could not supply from the raw text
+    estimated = []
+    if COUNT_TOKENS and "provider" in usage:
+        missing = [(field, usage[text_field])
+                   for field, text_field in (("prompt_tokens", "prompt"), ("completion_tokens", "response"))
+                   if usage.get(field) is None and isinstance(usage.get(text_field), str)]
+        counts = await asyncio.gather(*(token_counter.count(usage["provider"], text) for _, text in missing))
+        for (field, _), count in zip(missing, counts):
+            usage[field] = count
+            estimated.append(field)
+
     # Validate required fields
     required_fields = ["provider", "model", "prompt_tokens", "completion_tokens"]
     for field in required_fields:
@@ -214,54 +587,58 @@ async def log_usage(usage: Dict[str, Any]):
     except (ValueError, TypeError):
         raise HTTPException(status_code=400, detail="Token counts must be valid integers")
 
+    # Normalize the timestamp (its date picks the daily rollup bucket)
     try:
-        conn = get_db()
+        timestamp = parse_timestamp(usage.get("timestamp"))
+    except (ValueError, TypeError, OverflowError, OSError):
+        raise HTTPException(status_code=400, detail="timestamp must be ISO-8601 or Unix epoch seconds")
 
-        # Calculate cost based on pricing data
-        cursor = conn.execute(
-            "SELECT input_cost_per_1k, output_cost_per_1k FROM model_pricing WHERE provider = ? AND model = ?",
-            (usage["provider"], usage["model"])
-        )
-        pricing = cursor.fetchone()
+    try:
+        # Calculate cost based on pricing data (snapshot names and aliases
+        # resolve to the priced model)
+        resolved = pricing_cache.get().resolve(usage["provider"], usage["model"])
+        pricing_model, pricing = resolved or (None, None)
 
-        cost_usd = 0.0
+        cost_micros = 0
         if pricing:
-            input_cost = (prompt_tokens / 1000) * pricing["input_cost_per_1k"]
-            output_cost = (completion_tokens / 1000) * pricing["output_cost_per_1k"]
-            cost_usd = round(input_cost + output_cost, 6)
+            cost_micros = writer.cost_micros(prompt_tokens, completion_tokens, *pricing)
         else:
             # Warning: unknown model, still log but with $0 cost
             print(f"⚠️  Warning: Unknown model '{usage['provider']}/{usage['model']}' - cost set to $0")
 
+        metadata = usage.get("metadata", {})
+        if estimated:
+            metadata = {**metadata, "estimated_tokens": estimated}
+        if pricing_model and pricing_model != usage["model"]:
+            metadata = {**metadata, "pricing_model": pricing_model}
+
+        record = {
+            "provider": usage["provider"],
+            "model": usage["model"],
+            "timestamp": timestamp,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cost_micros": cost_micros,
+            "request_id": usage.get("request_id"),
+            "metadata": metadata,
+            "is_error": usage.get("success") is False or bool(usage.get("error"))
+        }
+        if tenant is not None:
+            record["tenant"] = tenant
+        if STORE_TEXT and (usage.get("prompt") is not None or usage.get("response") is not None):
+            record["text"] = {"prompt": usage.get("prompt"), "response": usage.get("response")}
+
         # Insert usage record
-        conn.execute("""
-            INSERT INTO api_usage
-            (provider, model, timestamp, prompt_tokens, completion_tokens, total_tokens, cost_usd, request_id, metadata)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            usage["provider"],
-            usage["model"],
-            usage.get("timestamp", datetime.datetime.utcnow().isoformat()),
-            prompt_tokens,
-            completion_tokens,
-            prompt_tokens + completion_tokens,
-            cost_usd,
-            usage.get("request_id"),
-            json.dumps(usage.get("metadata", {}))
-        ))
-
-        conn.commit()
-        conn.close()
+        await submit_write("usage", record)
 
         return {
             "status": "logged",
-            "cost_usd": cost_usd,
+            "cost_usd": cost_micros / writer.MICROS_PER_USD,
+            "pricing_model": pricing_model,
             "warning": None if pricing else f"Unknown model '{usage['provider']}/{usage['model']}' - cost set to $0"
         }
 
     except Exception as e:
-        if 'conn' in locals():
-            conn.close()
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 @app.get("/api/recommendations")
@@ -269,27 +646,38 @@ async def get_recommendations(current_model: str = None):
     """Get cheaper model recommendations."""
     conn = get_db()
 
-    # Get all models with pricing
+    # Top 5 cheapest models (prices are micro-dollars per 1M tokens)
     cursor = conn.execute("""
-        SELECT provider, model, input_cost_per_1k, output_cost_per_1k
-        FROM model_pricing
-        ORDER BY (input_cost_per_1k + output_cost_per_1k) ASC
+        SELECT m.provider, m.model,
+               p.input_micros_per_1m / 1e9 AS input_cost_per_1k,
+               p.output_micros_per_1m / 1e9 AS output_cost_per_1k,
+               ROUND((p.input_micros_per_1m + p.output_micros_per_1m) / 2e9, 6) AS avg_cost_per_1k
+        FROM model_pricing p JOIN models m ON m.id = p.model_id
+        ORDER BY (p.input_micros_per_1m + p.output_micros_per_1m) ASC
+        LIMIT 5
     """)
 
-    models = [dict(row) for row in cursor.fetchall()]
+    recommendations = [{**dict(row), "reason": "Low cost per token"} for row in cursor.fetchall()]
     conn.close()
 
-    recommendations = []
-    for model in models[:5]:  # Top 5 cheapest
-        avg_cost = round((model["input_cost_per_1k"] + model["output_cost_per_1k"]) / 2, 6)
-        recommendations.append({
-            **model,
-            "avg_cost_per_1k": avg_cost,
-            "reason": "Low cost per token"
-        })
-
     return {"recommendations": recommendations}
 
+# ============================================================================
+# ADMIN ENDPOINTS
+# ============================================================================
+
+@app.get("/api/admin/slow-queries", dependencies=[Depends(require_admin)])
+async def get_slow_queries(limit: int = 50):
+    """Get the most recent slow queries logged by this worker."""
+    entries = list(profiling.slow_queries)[-limit:][::-1]
+    return {"slow_queries": entries, "count": len(entries), "threshold_ms": profiling.SLOW_QUERY_MS}
+
+@app.get("/api/admin/profiles", dependencies=[Depends(require_admin)])
+async def get_profiles(limit: int = 10):
+    """Get the most recent request profiles captured by this worker."""
+    entries = list(profiling.profiles)[-limit:][::-1]
+    return {"profiles": entries, "count": len(entries)}
+
 # ============================================================================
 # SETTINGS ENDPOINTS
 # ============================================================================
@@ -297,25 +685,32 @@ async def get_recommendations(current_model: str = None):
 @app.get("/api/settings")
 async def get_settings():
     """Get all settings."""
-    conn = get_db()
-    cursor = conn.execute("SELECT key, value FROM settings")
-    settings = {row["key"]: json.loads(row["value"]) for row in cursor.fetchall()}
-    conn.close()
-    return settings
+    return settings_cache.get()
 
 @app.post("/api/settings")
 async def update_settings(settings: Dict[str, Any]):
     """Update settings."""
-    conn = get_db()
-    for key, value in settings.items():
-        conn.execute(
-            "INSERT OR REPLACE INTO settings (key, value, updated_at) VALUES (?, ?, ?)",
-            (key, json.dumps(value), datetime.datetime.utcnow().isoformat())
-        )
-    conn.commit()
-    conn.close()
+    await submit_write("settings", {
+        "values": settings,
+        "updated_at": datetime.datetime.utcnow().isoformat()
+    })
     return {"status": "updated"}
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if WORKERS > 1:
+        import multiprocessing
+
+        # Workers are separate processes; they find the writer through the env
+        WRITER_SOCKET = WRITER_SOCKET or os.path.join(
+            os.path.dirname(DATABASE_PATH) or ".", "writer.sock"
+        )
+        os.environ["LLMSCOPE_WRITER_SOCKET"] = WRITER_SOCKET
+
+        init_db()
+        multiprocessing.Process(
+            target=writer.run, args=(DATABASE_PATH, WRITER_SOCKET), daemon=True
+        ).start()
+        uvicorn.run("app:app", host="0.0.0.0", port=8000, workers=WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
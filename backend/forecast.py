@@ -0,0 +1,109 @@
+"""
+LLMscope - Cost Forecasting
+Projects month-end spend per provider/model from the daily cost rollup.
+Every series shares one design matrix (trend + day-of-week), so all of them
+are fitted with a single least-squares solve.
+"""
+
+import calendar
+import datetime
+from statistics import NormalDist
+
+import numpy as np
+
+
+def _design(day_index, weekdays):
+    """Intercept, linear trend and Tuesday..Sunday indicators (Monday is baseline)."""
+    X = np.zeros((len(day_index), 8))
+    X[:, 0] = 1.0
+    X[:, 1] = day_index
+    for dow in range(1, 7):
+        X[:, 1 + dow] = weekdays == dow
+    return X
+
+def _weekdays(start, count):
+    return (start.weekday() + np.arange(count)) % 7
+
+def forecast_month_end(rows, today, history_days=56, confidence=0.95):
+    """Fit every series in rows and project its spend to the end of today's month.
+
+    rows are (day, provider, model, cost) tuples covering the history window
+    [today - history_days, today); today's partial bucket is excluded so the
+    fit only ever sees complete days. Partials for the same bucket (e.g. from
+    several tenant shards) are summed.
+    """
+    start = today - datetime.timedelta(days=history_days)
+    month_start = today.replace(day=1)
+    month_end = today.replace(day=calendar.monthrange(today.year, today.month)[1])
+
+    # Buckets whose day does not parse (written before timestamps were
+    # validated on ingest) are skipped rather than failing the whole forecast
+    buckets = []
+    for day, provider, model, cost in rows:
+        try:
+            offset = (datetime.date.fromisoformat(day) - start).days
+        except (TypeError, ValueError):
+            continue
+        if 0 <= offset < history_days:
+            buckets.append((offset, (provider, model), cost))
+
+    keys = sorted({key for _, key, _ in buckets})
+    if not keys:
+        return {"series": [], "total": None}
+    series_index = {key: i for i, key in enumerate(keys)}
+
+    # Dense (series x day) cost matrix; missing buckets are zero spend
+    Y = np.zeros((len(keys), history_days))
+    for offset, key, cost in buckets:
+        Y[series_index[key], offset] += cost or 0.0
+
+    X = _design(np.arange(history_days), _weekdays(start, history_days))
+    beta, _, rank, _ = np.linalg.lstsq(X, Y.T, rcond=None)
+    residuals = Y.T - X @ beta
+    dof = max(history_days - rank, 1)
+    sigma = np.sqrt((residuals ** 2).sum(axis=0) / dof)
+
+    # Remaining days of the month, today included
+    horizon = (month_end - today).days + 1
+    future = _design(
+        np.arange(history_days, history_days + horizon), _weekdays(today, horizon)
+    )
+    daily = np.clip(future @ beta, 0.0, None)
+    remaining = daily.sum(axis=0)
+
+    # Variance of a sum of predictions: noise on each day plus the shared
+    # parameter uncertainty along the summed design row.
+    f = future.sum(axis=0)
+    leverage = float(f @ np.linalg.pinv(X.T @ X) @ f)
+    spread = sigma * np.sqrt(horizon + leverage)
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+
+    # Complete days of this month; history_days >= 31 keeps them all in Y
+    to_date = Y[:, (month_start - start).days:].sum(axis=1)
+
+    projected = to_date + remaining
+    lower = to_date + np.clip(remaining - z * spread, 0.0, None)
+    upper = projected + z * spread
+
+    series = [
+        {
+            "provider": provider,
+            "model": model,
+            "month_to_date": round(float(to_date[i]), 6),
+            "projected_month_end": round(float(projected[i]), 6),
+            "lower": round(float(lower[i]), 6),
+            "upper": round(float(upper[i]), 6),
+            "trend_per_day": round(float(beta[1, i]), 6),
+        }
+        for i, (provider, model) in enumerate(keys)
+    ]
+    series.sort(key=lambda item: item["projected_month_end"], reverse=True)
+
+    total_spread = z * float(np.sqrt((spread ** 2).sum()))
+    total = {
+        "month_to_date": round(float(to_date.sum()), 6),
+        "projected_month_end": round(float(projected.sum()), 6),
+        "lower": round(float(to_date.sum() + max(remaining.sum() - total_spread, 0.0)), 6),
+        "upper": round(float(projected.sum() + total_spread), 6),
+    }
+    return {"series": series, "total": total}
@@ -0,0 +1,135 @@
+"""
+LLMscope - Response Formats
+Compact encodings for large result sets: columnar JSON with dictionary-encoded
+string columns, MessagePack and Arrow IPC, plus gzip/brotli compression.
+"""
+
+import gzip
+import json
+
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import msgpack
+except ImportError:  # optional: format=msgpack
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # optional: format=arrow
+    pa = None
+
+try:
+    import brotli
+except ImportError:  # optional: Content-Encoding: br
+    brotli = None
+
+FORMATS = ("rows", "columnar", "msgpack", "arrow")
+
+# Accept header media types that select a format when ?format= is absent
+MEDIA_TYPES = {
+    "application/vnd.llmscope.columnar+json": "columnar",
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+    "application/vnd.apache.arrow.stream": "arrow",
+}
+
+# Responses smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+
+def negotiate(fmt, accept):
+    """Pick a response format from ?format= or the Accept header."""
+    if fmt:
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format '{fmt}' (use one of: {', '.join(FORMATS)})")
+        return fmt
+    for media_type in (accept or "").split(","):
+        chosen = MEDIA_TYPES.get(media_type.split(";")[0].strip())
+        if chosen:
+            return chosen
+    return "rows"
+
+def to_columns(names, rows, dictionary=()):
+    """Transpose rows into one list per column.
+
+    Columns named in `dictionary` are encoded as {"dictionary": [...],
+    "indices": [...]} so repeated strings are sent once.
+    """
+    columns = dict(zip(names, map(list, zip(*rows)))) if rows else {name: [] for name in names}
+    for name in dictionary:
+        codes = {}
+        indices = [codes.setdefault(value, len(codes)) for value in columns[name]]
+        columns[name] = {"dictionary": list(codes), "indices": indices}
+    return columns
+
+def render(fmt, names, rows, extra, dictionary=("provider", "model"), key="usage"):
+    """Build the response for a result set in the negotiated format."""
+    if fmt == "rows":
+        return JSONResponse({key: [dict(zip(names, row)) for row in rows], **extra})
+
+    if fmt == "columnar":
+        return Response(
+            json.dumps({"columns": to_columns(names, rows, dictionary), **extra}, separators=(",", ":")),
+            media_type="application/vnd.llmscope.columnar+json",
+        )
+
+    if fmt == "msgpack":
+        if msgpack is None:
+            raise LookupError("format=msgpack requires the 'msgpack' package")
+        return Response(
+            msgpack.packb({"columns": to_columns(names, rows, dictionary), **extra}),
+            media_type="application/x-msgpack",
+        )
+
+    if pa is None:
+        raise LookupError("format=arrow requires the 'pyarrow' package")
+    columns = to_columns(names, rows, dictionary)
+    arrays = {
+        name: (pa.DictionaryArray.from_arrays(pa.array(col["indices"], pa.int32()), pa.array(col["dictionary"]))
+               if name in dictionary else pa.array(col))
+        for name, col in columns.items()
+    }
+    table = pa.table(arrays).replace_schema_metadata({k: json.dumps(v) for k, v in extra.items()})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as stream:
+        stream.write_table(table)
+    return Response(sink.getvalue().to_pybytes(), media_type="application/vnd.apache.arrow.stream")
+
+def _q_values(accept_encoding):
+    """Map each coding in an Accept-Encoding header to its q-value."""
+    weights = {}
+    for part in (accept_encoding or "").split(","):
+        coding, *params = [piece.strip() for piece in part.split(";")]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding.lower()] = q
+    return weights
+
+def choose_encoding(accept_encoding):
+    """Return 'br', 'gzip' or None for an Accept-Encoding header.
+
+    Codings with q=0 are never used; "*" covers codings not listed by name.
+    Ties go to brotli.
+    """
+    weights = _q_values(accept_encoding)
+    supported = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best, best_q = None, 0.0
+    for coding in supported:
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
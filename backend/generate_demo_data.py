@@ -9,6 +9,8 @@ import os
 import random
 from datetime import datetime, timedelta
 
+from writer import MICROS_PER_USD, ModelIds, cost_micros, write_usage
+
 DATABASE_PATH = os.getenv("DATABASE_PATH", "./data/llmscope.db")
 
 # Realistic token ranges for different model sizes
@@ -35,41 +37,36 @@ DEMO_MODELS = [
 ]
 
 def calculate_cost(provider, model, prompt_tokens, completion_tokens):
-    """Calculate cost based on pricing data."""
+    """Calculate cost in micro-dollars based on pricing data."""
     conn = sqlite3.connect(DATABASE_PATH)
     cursor = conn.cursor()
 
     cursor.execute("""
-        SELECT input_cost_per_1k, output_cost_per_1k
-        FROM model_pricing
-        WHERE provider = ? AND model = ?
+        SELECT p.input_micros_per_1m, p.output_micros_per_1m
+        FROM model_pricing p JOIN models m ON m.id = p.model_id
+        WHERE m.provider = ? AND m.model = ?
     """, (provider, model))
 
     result = cursor.fetchone()
     conn.close()
 
     if not result:
-        return 0.0
-
-    input_cost_per_1k, output_cost_per_1k = result
-
-    cost = (prompt_tokens / 1000 * input_cost_per_1k) + \
-           (completion_tokens / 1000 * output_cost_per_1k)
+        return 0
 
-    return round(cost, 6)
+    return cost_micros(prompt_tokens, completion_tokens, *result)
 
 def generate_demo_data(num_requests=100):
     """Generate realistic demo data."""
 
     conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
 
     # Generate requests over the last 7 days
     end_time = datetime.utcnow()
     start_time = end_time - timedelta(days=7)
 
     inserted = 0
-    total_cost = 0.0
+    total_cost = 0
+    model_ids = ModelIds()
 
     for _ in range(num_requests):
         # Pick random model
@@ -83,8 +80,6 @@ def generate_demo_data(num_requests=100):
         completion_ratio = random.uniform(0.1, 0.5)
         completion_tokens = int(prompt_tokens * completion_ratio)
 
-        total_tokens = prompt_tokens + completion_tokens
-
         # Calculate cost
         cost = calculate_cost(provider, model, prompt_tokens, completion_tokens)
         total_cost += cost
@@ -93,19 +88,22 @@ def generate_demo_data(num_requests=100):
         time_delta = random.uniform(0, (end_time - start_time).total_seconds())
         timestamp = start_time + timedelta(seconds=time_delta)
 
-        # Insert into database
-        cursor.execute("""
-            INSERT INTO api_usage
-            (provider, model, timestamp, prompt_tokens, completion_tokens, total_tokens, cost_usd)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (provider, model, timestamp.isoformat(), prompt_tokens, completion_tokens, total_tokens, cost))
+        # Insert into database (keeps the daily rollup in step)
+        write_usage(conn, {
+            "provider": provider,
+            "model": model,
+            "timestamp": timestamp.isoformat(),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cost_micros": cost
+        }, model_ids)
 
         inserted += 1
 
     conn.commit()
     conn.close()
 
-    return inserted, total_cost
+    return inserted, total_cost / MICROS_PER_USD
 
 if __name__ == "__main__":
     print("🎲 Generating Demo Data for LLMscope...")
@@ -0,0 +1,242 @@
+"""
+LLMscope - Query & Request Profiling
+A slow-query log for SQLite connections and opt-in cProfile capture of whole
+requests. Recent entries are kept in memory for the admin endpoints.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+
+# Log statements slower than this (milliseconds); unset disables the log
+SLOW_QUERY_MS = float(os.getenv("LLMSCOPE_SLOW_QUERY_MS", "0"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("LLMSCOPE_SLOW_QUERY_LOG_SIZE", "200"))
+# Let admin requests ask for a profile with the header below
+PROFILING = os.getenv("LLMSCOPE_PROFILING", "false").lower() == "true"
+PROFILE_HEADER = "X-LLMscope-Profile"
+# Fraction of all requests to profile
+PROFILE_SAMPLE_RATE = float(os.getenv("LLMSCOPE_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_LOG_SIZE = int(os.getenv("LLMSCOPE_PROFILE_LOG_SIZE", "50"))
+# The progress handler fires every this many SQLite VM instructions
+PROGRESS_STEPS = 1000
+
+slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+profiles = deque(maxlen=PROFILE_LOG_SIZE)
+
+# Query timings for the request being profiled, if any
+_request_queries = ContextVar("request_queries", default=None)
+# cProfile can only profile one request at a time per process
+_profile_lock = threading.Lock()
+_profile_ids = iter(range(1, 1 << 62))
+
+
+def enabled():
+    """Whether connections need the profiling hooks at all."""
+    return SLOW_QUERY_MS > 0 or PROFILING or PROFILE_SAMPLE_RATE > 0
+
+
+def params_shape(params):
+    """Describe bound parameters by type only, never by value."""
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in params.items()}
+    shape = [type(value).__name__ for value in params]
+    return shape if len(shape) <= 20 else shape[:20] + [f"... {len(shape)} total"]
+
+# ============================================================================
+# SLOW-QUERY LOG
+# ============================================================================
+
+class ProfiledCursor(sqlite3.Cursor):
+    """Cursor that times each statement from execute() until its rows are read.
+
+    The entry is recorded once the rows run out, on the next execute(), or
+    when the cursor is closed or freed, so partly read results count too.
+    """
+
+    _sql = None
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        self._sql, self._params = sql, parameters
+        self._elapsed = 0.0
+        self.connection.begin_statement()
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._elapsed += time.perf_counter() - start
+            if self.description is None:
+                self._finish()
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._elapsed += time.perf_counter() - start
+            self._finish()
+            raise
+        self._elapsed += time.perf_counter() - start
+        return row
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._elapsed += time.perf_counter() - start
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._elapsed += time.perf_counter() - start
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._elapsed += time.perf_counter() - start
+            self._finish()
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+    def _finish(self):
+        if self._sql is None:
+            return
+        sql, params, self._sql = self._sql, self._params, None
+        steps, statements = self.connection.end_statement()
+        record_query(self.connection, sql, params, self._elapsed * 1000, steps, statements)
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """Connection whose statements feed the slow-query log.
+
+    The progress handler counts VM instructions and the trace callback counts
+    statements SQLite actually ran (including trigger bodies), so each entry
+    shows how much work a query did, not just how long it took.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._steps = 0
+        self._statements = 0
+        self.set_progress_handler(self._on_progress, PROGRESS_STEPS)
+        self.set_trace_callback(self._on_trace)
+
+    def _on_progress(self):
+        self._steps += PROGRESS_STEPS
+        return 0
+
+    def _on_trace(self, statement):
+        self._statements += 1
+
+    def begin_statement(self):
+        self._steps = self._statements = 0
+
+    def end_statement(self):
+        return self._steps, self._statements
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def commit(self):
+        start = time.perf_counter()
+        super().commit()
+        record_query(self, "COMMIT", (), (time.perf_counter() - start) * 1000, 0, 1)
+
+def connection_factory():
+    """Connection class for sqlite3.connect(factory=...)."""
+    return ProfiledConnection if enabled() else sqlite3.Connection
+
+def _query_plan(conn, sql, params):
+    if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+        return None
+    try:
+        rows = sqlite3.Connection.execute(conn, f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    except sqlite3.Error:
+        return None
+    return [row[-1] for row in rows]
+
+def record_query(conn, sql, params, duration_ms, steps, statements):
+    queries = _request_queries.get()
+    if queries is not None:
+        queries.append({"sql": " ".join(sql.split()), "duration_ms": round(duration_ms, 3)})
+
+    if SLOW_QUERY_MS <= 0 or duration_ms < SLOW_QUERY_MS:
+        return
+    entry = {
+        "at": time.time(),
+        "sql": " ".join(sql.split()),
+        "params": params_shape(params),
+        "duration_ms": round(duration_ms, 3),
+        "vm_steps": steps,
+        "statements": statements,
+        "plan": _query_plan(conn, sql, params),
+    }
+    slow_queries.append(entry)
+    print(f"🐢 Slow query ({entry['duration_ms']} ms): {entry['sql'][:200]}")
+
+# ============================================================================
+# REQUEST PROFILING
+# ============================================================================
+
+def wants_profile(requested):
+    """Decide whether to profile a request (requested: header from an admin)."""
+    if requested and PROFILING:
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+async def profile_request(request, call_next):
+    """Run call_next under cProfile and keep the result for the admin endpoint.
+
+    Other requests interleaved on the event loop are captured too, and work
+    done in thread pools is not; the per-query timings fill that gap.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return await call_next(request)
+
+    queries = []
+    token = _request_queries.set(queries)
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    try:
+        profiler.enable()
+        response = await call_next(request)
+    finally:
+        profiler.disable()
+        _request_queries.reset(token)
+        _profile_lock.release()
+
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(30)
+    profiles.append({
+        "id": next(_profile_ids),
+        "at": time.time(),
+        "method": request.method,
+        "path": request.url.path,
+        "status": response.status_code,
+        "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+        "queries": queries,
+        "profile": stream.getvalue(),
+    })
+    return response
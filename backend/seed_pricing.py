@@ -10,10 +10,12 @@ import sqlite3
 import os
 from datetime import datetime
 
+from writer import ModelIds, bump_cache_generation, create_pricing_table, price_to_micros
+
 DATABASE_PATH = os.getenv("DATABASE_PATH", "./data/llmscope.db")
 
 # Pricing data: (provider, model, input_cost_per_1k, output_cost_per_1k)
-# All costs in USD per 1,000 tokens
+# All costs in USD per 1,000 tokens (stored as integer micro-dollars per 1M tokens)
 PRICING_DATA = [
     # OpenAI Models
     ("openai", "gpt-4-turbo", 0.01, 0.03),
@@ -115,18 +117,8 @@ def seed_pricing():
     conn = sqlite3.connect(DATABASE_PATH)
     cursor = conn.cursor()
 
-    # Create table if it doesn't exist
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS model_pricing (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            provider TEXT NOT NULL,
-            model TEXT NOT NULL,
-            input_cost_per_1k REAL NOT NULL,
-            output_cost_per_1k REAL NOT NULL,
-            last_updated TEXT NOT NULL,
-            UNIQUE(provider, model)
-        )
-    """)
+    # Create (or migrate) the table
+    create_pricing_table(cursor)
 
     timestamp = datetime.utcnow().isoformat()
 
@@ -134,23 +126,28 @@ def seed_pricing():
     inserted = 0
     updated = 0
 
+    model_ids = ModelIds()
     for provider, model, input_cost, output_cost in PRICING_DATA:
+        model_id = model_ids.get(cursor, provider, model)
+        input_cost, output_cost = price_to_micros(input_cost), price_to_micros(output_cost)
         try:
             cursor.execute("""
-                INSERT INTO model_pricing (provider, model, input_cost_per_1k, output_cost_per_1k, last_updated)
-                VALUES (?, ?, ?, ?, ?)
-            """, (provider, model, input_cost, output_cost, timestamp))
+                INSERT INTO model_pricing (model_id, input_micros_per_1m, output_micros_per_1m, last_updated)
+                VALUES (?, ?, ?, ?)
+            """, (model_id, input_cost, output_cost, timestamp))
             inserted += 1
         except sqlite3.IntegrityError:
             # Record already exists, update it
             cursor.execute("""
                 UPDATE model_pricing
-                SET input_cost_per_1k = ?, output_cost_per_1k = ?, last_updated = ?
-                WHERE provider = ? AND model = ?
-            """, (input_cost, output_cost, timestamp, provider, model))
+                SET input_micros_per_1m = ?, output_micros_per_1m = ?, last_updated = ?
+                WHERE model_id = ?
+            """, (input_cost, output_cost, timestamp, model_id))
             updated += 1
 
     conn.commit()
+    # Running backend workers reload their cached pricing
+    bump_cache_generation(DATABASE_PATH)
 
     # Show summary
     print(f"\n✅ Pricing Data Seeded Successfully!")
@@ -161,9 +158,9 @@ def seed_pricing():
 
     # Show breakdown by provider
     cursor.execute("""
-        SELECT provider, COUNT(*) as count
-        FROM model_pricing
-        GROUP BY provider
+        SELECT m.provider, COUNT(*) as count
+        FROM model_pricing p JOIN models m ON m.id = p.model_id
+        GROUP BY m.provider
         ORDER BY count DESC
     """)
 
@@ -173,9 +170,9 @@ def seed_pricing():
 
     # Show cheapest models
     cursor.execute("""
-        SELECT provider, model,
-               ROUND((input_cost_per_1k + output_cost_per_1k) / 2, 6) as avg_cost
-        FROM model_pricing
+        SELECT m.provider, m.model,
+               ROUND((p.input_micros_per_1m + p.output_micros_per_1m) / 2e9, 6) as avg_cost
+        FROM model_pricing p JOIN models m ON m.id = p.model_id
         WHERE avg_cost > 0
         ORDER BY avg_cost ASC
         LIMIT 5
@@ -0,0 +1,169 @@
+"""
+LLMscope - Tenant Shards
+Each tenant's usage data lives in its own SQLite file. Open handles are kept
+in an LRU so thousands of tenants never exhaust file descriptors.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import profiling
+
+DATABASE_PATH = os.getenv("DATABASE_PATH", "./data/llmscope.db")
+TENANTS_DIR = os.getenv(
+    "LLMSCOPE_TENANTS_DIR", os.path.join(os.path.dirname(DATABASE_PATH) or ".", "tenants")
+)
+# Most shard files held open at once per process
+MAX_OPEN_SHARDS = int(os.getenv("LLMSCOPE_MAX_OPEN_SHARDS", "256"))
+
+# Tenant names become file names, so keep them to a safe alphabet
+TENANT_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def valid_tenant(tenant: str) -> bool:
+    return bool(TENANT_RE.match(tenant))
+
+
+class _Shard:
+    def __init__(self):
+        self.conn = None  # opened by the first lease holder, outside the LRU lock
+        self.lock = threading.Lock()
+        self.leases = 0
+
+
+class ShardManager:
+    """LRU of open per-tenant connections.
+
+    A connection is leased to one caller at a time; leased shards are never
+    closed, so the LRU can briefly exceed `max_open` under heavy fan-out.
+
+    Only the writer's manager (readonly=False) creates shards or changes their
+    schema. Readers open shards with SQLite's read-only mode, so API workers
+    never write to files the writer owns.
+    """
+
+    def __init__(self, directory, init_schema, max_open=MAX_OPEN_SHARDS, readonly=False):
+        self.directory = directory
+        self.init_schema = init_schema
+        self.max_open = max_open
+        self.readonly = readonly
+        self._open = OrderedDict()  # tenant -> _Shard, least recently used first
+        self._lock = threading.Lock()
+
+    def path(self, tenant):
+        if not valid_tenant(tenant):
+            raise ValueError(f"Invalid tenant name '{tenant}'")
+        return os.path.join(self.directory, f"{tenant}.db")
+
+    def tenants(self):
+        """List tenants that have a shard on disk."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-3] for name in names if name.endswith(".db") and valid_tenant(name[:-3]))
+
+    def _connect(self, tenant):
+        path = self.path(tenant)
+        if self.readonly:
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30,
+                                   check_same_thread=False, factory=profiling.connection_factory())
+            conn.row_factory = sqlite3.Row
+            return conn
+        if not os.path.exists(path):
+            self._create(path)
+        conn = sqlite3.connect(path, timeout=30, check_same_thread=False,
+                               factory=profiling.connection_factory())
+        conn.row_factory = sqlite3.Row
+        # Idempotent: migrates shards written by an older version
+        self.init_schema(conn)
+        conn.commit()
+        return conn
+
+    def _create(self, path):
+        """Build a new shard beside its final name, so readers never see it half made."""
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = path + ".tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)  # left by a crash mid-create
+        conn = sqlite3.connect(tmp)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.init_schema(conn)
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp, path)
+
+    def _empty(self):
+        """In-memory stand-in for a tenant that has no shard yet."""
+        conn = sqlite3.connect(":memory:", check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        self.init_schema(conn)
+        return conn
+
+    @contextmanager
+    def connect(self, tenant, create=False):
+        """Lease the tenant's connection, opening it if needed.
+
+        Only ingest passes create=True. Readers of a tenant without a shard
+        get an empty database, so made-up tenant names never touch the disk.
+        Cold shards are opened under their own lock, not the LRU's, so a
+        fan-out across many tenants opens them in parallel.
+        """
+        if create and self.readonly:
+            raise ValueError("A read-only shard manager cannot create shards")
+        with self._lock:
+            shard = self._open.get(tenant)
+            missing = shard is None and not create and not os.path.exists(self.path(tenant))
+            if not missing:
+                if shard is None:
+                    shard = self._open[tenant] = _Shard()
+                else:
+                    self._open.move_to_end(tenant)
+                shard.leases += 1
+                self._evict()
+
+        if missing:
+            conn = self._empty()
+            try:
+                yield conn
+            finally:
+                conn.close()
+            return
+
+        try:
+            with shard.lock:
+                if shard.conn is None:
+                    # A failed open leaves conn unset for the next lease to retry
+                    shard.conn = self._connect(tenant)
+                yield shard.conn
+        finally:
+            with self._lock:
+                shard.leases -= 1
+
+    def migrate(self):
+        """Bring every shard on disk up to the current schema (writer startup)."""
+        for tenant in self.tenants():
+            with self.connect(tenant, create=True):
+                pass
+
+    def _evict(self):
+        while len(self._open) > self.max_open:
+            idle = next((t for t, s in self._open.items() if s.leases == 0), None)
+            if idle is None:
+                return
+            shard = self._open.pop(idle)
+            if shard.conn is not None:
+                shard.conn.close()
+
+    def close_all(self):
+        with self._lock:
+            for shard in self._open.values():
+                if shard.conn is not None:
+                    shard.conn.close()
+            self._open.clear()
@@ -0,0 +1,196 @@
+"""
+LLMscope - Heavy-Hitter Sketches
+Streaming top-K cost tracking for high-cardinality metadata keys (users, API
+keys, prompts). Each key/window pair is a ring of weighted Space-Saving
+summaries, so memory stays fixed no matter how many distinct values arrive.
+"""
+
+import heapq
+import os
+import re
+import time
+
+# Metadata keys to track, e.g. "user_id,api_key"
+TOPK_KEYS = [k.strip() for k in os.getenv("LLMSCOPE_TOPK_KEYS", "").split(",") if k.strip()]
+# Sliding windows to keep per key, e.g. "1h,24h,7d"
+TOPK_WINDOWS = [w.strip() for w in os.getenv("LLMSCOPE_TOPK_WINDOWS", "1h,24h,7d").split(",") if w.strip()]
+# Counters per summary; an item's error is at most total cost / capacity
+TOPK_CAPACITY = int(os.getenv("LLMSCOPE_TOPK_CAPACITY", "1000"))
+# Sub-buckets per window; the window slides in steps of window / slices
+TOPK_SLICES = 24
+
+_UNITS = {"m": 60, "h": 3600, "d": 86400}
+
+
+def parse_window(spec: str) -> int:
+    """Convert a window like '15m', '24h' or '7d' to seconds."""
+    match = re.fullmatch(r"(\d+)([mhd])", spec)
+    if not match:
+        raise ValueError(f"Invalid window '{spec}' (use e.g. 15m, 24h, 7d)")
+    return int(match.group(1)) * _UNITS[match.group(2)]
+
+
+class SpaceSaving:
+    """Weighted Space-Saving summary with at most `capacity` counters.
+
+    Each tracked item stores (count, error): count overestimates the item's
+    true total by at most error. A min-heap with lazy deletion finds the
+    counter to evict.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counters = {}
+        self._heap = []
+
+    def add(self, item, weight):
+        if item in self.counters:
+            count, error = self.counters[item]
+            self.counters[item] = (count + weight, error)
+        elif len(self.counters) < self.capacity:
+            self.counters[item] = (weight, 0)
+        else:
+            floor, victim = self._pop_min()
+            del self.counters[victim]
+            self.counters[item] = (floor + weight, floor)
+        heapq.heappush(self._heap, (self.counters[item][0], item))
+
+        # Drop stale heap entries before they outgrow the counters
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(count, key) for key, (count, _) in self.counters.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        while True:
+            count, item = heapq.heappop(self._heap)
+            if item in self.counters and self.counters[item][0] == count:
+                return count, item
+
+    def min_count(self):
+        """Upper bound on the total of any item not being tracked."""
+        if len(self.counters) < self.capacity:
+            return 0
+        while True:
+            count, item = self._heap[0]
+            if item in self.counters and self.counters[item][0] == count:
+                return count
+            heapq.heappop(self._heap)
+
+
+class WindowedTopK:
+    """Sliding-window heavy hitters built from a ring of Space-Saving slices."""
+
+    def __init__(self, window_seconds, capacity=TOPK_CAPACITY, slices=TOPK_SLICES):
+        self.window_seconds = window_seconds
+        self.slice_seconds = max(window_seconds // slices, 1)
+        self.capacity = capacity
+        self.slices = slices
+        self._ring = {}  # slice number -> SpaceSaving
+
+    def add(self, item, weight, now):
+        current = int(now // self.slice_seconds)
+        summary = self._ring.get(current)
+        if summary is None:
+            summary = self._ring[current] = SpaceSaving(self.capacity)
+            for old in [n for n in self._ring if n <= current - self.slices]:
+                del self._ring[old]
+        summary.add(item, weight)
+
+    def live(self, now):
+        """Space-Saving summaries of the slices still inside the window."""
+        current = int(now // self.slice_seconds)
+        return [s for n, s in self._ring.items() if n > current - self.slices]
+
+    def top(self, k, now):
+        return top_k(self.live(now), k)
+
+
+def top_k(summaries, k, tenants=None):
+    """Merge Space-Saving summaries and return the k largest items with bounds.
+
+    The summaries may come from different slices of a sketch. With `tenants`,
+    items are (tenant, value) pairs: only those tenants count, and each
+    value's cost is summed across them.
+    """
+    if tenants is not None:
+        tenants = set(tenants)
+    upper, lower = {}, {}
+    tracked = []  # per summary: value -> how many in-scope tenants it is tracked for
+    for summary in summaries:
+        seen = {}
+        for item, (count, error) in summary.counters.items():
+            if tenants is not None:
+                tenant, item = item
+                if tenant not in tenants:
+                    continue
+            upper[item] = upper.get(item, 0) + count
+            lower[item] = lower.get(item, 0) + count - error
+            seen[item] = seen.get(item, 0) + 1
+        tracked.append(seen)
+    # An item missing from a full summary may still have spent up to its floor,
+    # once per tenant in scope
+    scope = 1 if tenants is None else len(tenants)
+    for summary, seen in zip(summaries, tracked):
+        floor = summary.min_count()
+        if floor:
+            for item in upper:
+                upper[item] += floor * (scope - seen.get(item, 0))
+
+    # Weights are integer micro-dollars; report dollars
+    return [
+        {"value": item, "cost_usd": upper[item] / 1_000_000,
+         "error_usd": (upper[item] - lower[item]) / 1_000_000,
+         "guaranteed_usd": lower[item] / 1_000_000}
+        for item in heapq.nlargest(k, upper, key=upper.get)
+    ]
+
+
+def _tag(tenant):
+    """Tenant tag for sketch items; "" (never a valid tenant name) is the default
+    database, so items stay orderable in the Space-Saving heap."""
+    return tenant or ""
+
+
+class HeavyHitters:
+    """Top-K sketches for every configured metadata key and window.
+
+    One sketch per key and window serves every tenant: items are
+    (tenant, value) pairs, so memory is bounded by the counters alone
+    (keys x windows x TOPK_SLICES x capacity) however many tenants write.
+    """
+
+    def __init__(self, keys=TOPK_KEYS, windows=TOPK_WINDOWS, capacity=TOPK_CAPACITY):
+        self.keys = list(keys)
+        self.capacity = capacity
+        self.windows = list(windows)
+        self._sketches = {
+            (key, window): WindowedTopK(parse_window(window), capacity)
+            for key in self.keys
+            for window in self.windows
+        }
+
+    def add(self, metadata, cost_micros, now=None, tenant=None):
+        """Attribute one record's cost (micro-dollars) to each configured metadata value."""
+        if not self.keys or not cost_micros or not isinstance(metadata, dict):
+            return
+        now = time.time() if now is None else now
+        for key in self.keys:
+            value = metadata.get(key)
+            if value is None:
+                continue
+            for window in self.windows:
+                self._sketches[(key, window)].add((_tag(tenant), str(value)), cost_micros, now)
+
+    def tracks(self, key, window):
+        return (key, window) in self._sketches
+
+    def live(self, key, window, now=None):
+        """Live summaries for one key and window; items are (tenant, value) pairs."""
+        sketch = self._sketches.get((key, window))
+        if sketch is None:
+            raise KeyError(f"No sketch for key '{key}' and window '{window}'")
+        return sketch.live(time.time() if now is None else now)
+
+    def top(self, key, window, k=10, now=None, tenants=(None,)):
+        """Top k values over the given tenants (None is the default database)."""
+        return top_k(self.live(key, window, now), k, [_tag(t) for t in tenants])
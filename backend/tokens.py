@@ -0,0 +1,110 @@
+"""
+LLMscope - Server-Side Token Counting
+Estimates prompt/completion token counts from raw text when a client logs a
+call without them. Counting is CPU-bound, so it runs in a process pool and
+results are memoized by content hash.
+"""
+
+import asyncio
+import hashlib
+import math
+import multiprocessing
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # optional: exact counts for OpenAI models
+    tiktoken = None
+
+# Average characters per token for providers without a bundled tokenizer.
+# Figures are from each provider's published rules of thumb.
+CHARS_PER_TOKEN = {
+    "openai": 4.0,
+    "azure": 4.0,
+    "anthropic": 3.5,
+    "bedrock": 3.5,
+    "google": 4.0,
+    "cohere": 4.0,
+}
+DEFAULT_CHARS_PER_TOKEN = 3.8
+
+# Words, numbers (split into groups of up to three digits), runs of
+# punctuation and whitespace - the same pre-tokenization BPE tokenizers use.
+_PIECE_RE = re.compile(r"\s?[^\W\d_]+|\d{1,3}|\s?[^\s\w]+|\s+", re.UNICODE)
+
+
+@lru_cache(maxsize=None)
+def _tiktoken_encoding(provider: str):
+    if tiktoken is None or provider not in ("openai", "azure"):
+        return None
+    return tiktoken.get_encoding("cl100k_base")
+
+def count_tokens(provider: str, text: str) -> int:
+    """Count (or estimate) the tokens in text for the given provider.
+
+    Runs inside pool processes, so it must stay a plain module-level function.
+    """
+    encoding = _tiktoken_encoding(provider)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+
+    chars_per_token = CHARS_PER_TOKEN.get(provider, DEFAULT_CHARS_PER_TOKEN)
+    return sum(
+        math.ceil(len(piece) / chars_per_token)
+        for piece in _PIECE_RE.findall(text)
+        if not piece.isspace()
+    )
+
+
+class TokenCounter:
+    """Memoized token counting backed by a process pool."""
+
+    def __init__(self, max_workers=None, cache_size=10000):
+        self.max_workers = max_workers
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._pool = None
+
+    async def count(self, provider: str, text: str) -> int:
+        """Return the token count for text, counting in the pool on a cache miss."""
+        key = hashlib.sha256(f"{provider}\0{text}".encode("utf-8")).digest()
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        if self._pool is None:
+            self.start()
+        tokens = await asyncio.get_running_loop().run_in_executor(
+            self._pool, count_tokens, provider, text
+        )
+
+        self._cache[key] = tokens
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return tokens
+
+    def start(self):
+        """Create the pool and start its workers.
+
+        Workers come from a forkserver rather than by forking the calling
+        process, which inside uvicorn already runs threads; a fork could
+        inherit a lock held by one of them and deadlock. Call this from the
+        startup hook so the first request doesn't pay for process start-up.
+        """
+        if self._pool is not None:
+            return
+        workers = self.max_workers or os.cpu_count() or 1
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("forkserver")
+        )
+        for future in [self._pool.submit(count_tokens, "", "") for _ in range(workers)]:
+            future.result()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,753 @@
+#!/usr/bin/env python3
+"""
+LLMscope - Single Writer Process
+Owns every write to the SQLite database when the backend runs with several
+uvicorn workers. API workers hand records over a Unix socket and the writer
+applies them in batched transactions, so workers never contend for the lock.
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import random
+import sqlite3
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import profiling
+import shards
+import sketches
+
+DATABASE_PATH = os.getenv("DATABASE_PATH", "./data/llmscope.db")
+WRITER_SOCKET = os.getenv("LLMSCOPE_WRITER_SOCKET")
+
+# Largest number of queued writes committed in one transaction
+MAX_BATCH = int(os.getenv("LLMSCOPE_WRITER_MAX_BATCH", "500"))
+# Per-line limit on the socket (records can carry prompt/response text)
+STREAM_LIMIT = 16 * 1024 * 1024
+# How long a worker waits for the writer to acknowledge a record
+SUBMIT_TIMEOUT_S = 30
+
+# Sampled raw storage: every record updates the exact daily aggregates, but
+# only this fraction of raw rows is kept in api_usage. Errors and records far
+# more expensive than usual for their model are always kept.
+RAW_SAMPLE_RATE = float(os.getenv("LLMSCOPE_RAW_SAMPLE_RATE", "1.0"))
+RAW_KEEP_COST_USD = float(os.getenv("LLMSCOPE_RAW_KEEP_COST_USD", "0"))
+RAW_OUTLIER_FACTOR = float(os.getenv("LLMSCOPE_RAW_OUTLIER_FACTOR", "5"))
+
+# Most (provider, model) -> ID entries cached per database
+MODEL_ID_CACHE_SIZE = 10000
+
+# Writes that change data the API workers keep cached in memory
+INVALIDATING_OPS = {"pricing", "aliases", "settings"}
+
+# Top-K cost sketches live next to the writes that feed them. One set serves
+# every tenant; items are tagged with the tenant (None is the default database)
+# and queries filter on it, so tenants never see each other's values.
+heavy_hitters = sketches.HeavyHitters()
+
+
+class WriterError(Exception):
+    """Raised when the writer process rejects a write."""
+
+# ============================================================================
+# COST ARITHMETIC
+# ============================================================================
+# Costs are integer micro-dollars everywhere below the API, so aggregation is
+# exact; endpoints divide by MICROS_PER_USD only when building responses.
+
+MICROS_PER_USD = 1_000_000
+# $ per 1K tokens -> micro-dollars per 1M tokens
+PER_1K_TO_MICROS_PER_1M = 1_000_000_000
+
+def price_to_micros(cost_per_1k):
+    """Convert a $/1K-token price to integer micro-dollars per 1M tokens."""
+    return round(cost_per_1k * PER_1K_TO_MICROS_PER_1M)
+
+def cost_micros(prompt_tokens, completion_tokens, input_micros_per_1m, output_micros_per_1m):
+    """Cost of one call in micro-dollars, rounded half up."""
+    total = prompt_tokens * input_micros_per_1m + completion_tokens * output_micros_per_1m
+    return (total + 500_000) // 1_000_000
+
+
+def connect(db_path=DATABASE_PATH):
+    """Open a connection tuned for a long-lived writer."""
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False,
+                           factory=profiling.connection_factory())
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+# Column definitions for tables that reference models(id); kept here so the
+# migration that rebuilds older, name-keyed tables can recreate them
+API_USAGE_COLUMNS = """
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    model_id INTEGER NOT NULL REFERENCES models(id),
+    timestamp TEXT NOT NULL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    total_tokens INTEGER,
+    cost_micros INTEGER NOT NULL DEFAULT 0,
+    request_id TEXT,
+    metadata TEXT,
+    sample_rate REAL NOT NULL DEFAULT 1
+"""
+USAGE_DAILY_COLUMNS = """
+    day TEXT NOT NULL,
+    model_id INTEGER NOT NULL REFERENCES models(id),
+    request_count INTEGER NOT NULL DEFAULT 0,
+    total_tokens INTEGER NOT NULL DEFAULT 0,
+    total_cost_micros INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, model_id)
+"""
+MODEL_PRICING_COLUMNS = """
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    model_id INTEGER NOT NULL UNIQUE REFERENCES models(id),
+    input_micros_per_1m INTEGER NOT NULL,
+    output_micros_per_1m INTEGER NOT NULL,
+    last_updated TEXT NOT NULL
+"""
+
+def create_models_table(c):
+    """Create the provider/model dimension that usage and pricing rows reference."""
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS models (
+            id INTEGER PRIMARY KEY,
+            provider TEXT NOT NULL,
+            model TEXT NOT NULL,
+            UNIQUE(provider, model)
+        )
+    """)
+
+def create_usage_tables(c):
+    """Create (or migrate) the tables that hold usage data.
+
+    Shared by the main database and every tenant shard. Each database has its
+    own models table, so model IDs are only meaningful within one file.
+    """
+    create_models_table(c)
+
+    # Cost tracking table
+    c.execute(f"CREATE TABLE IF NOT EXISTS api_usage ({API_USAGE_COLUMNS})")
+
+    # Databases created before raw-row sampling lack the sample_rate column
+    columns = {row[1] for row in c.execute("PRAGMA table_info(api_usage)")}
+    if "sample_rate" not in columns:
+        c.execute("ALTER TABLE api_usage ADD COLUMN sample_rate REAL NOT NULL DEFAULT 1")
+    # ...and stored cost as REAL dollars instead of integer micro-dollars
+    if "cost_usd" in columns:
+        _migrate_to_micros(c, "api_usage", "cost_usd", "cost_micros", MICROS_PER_USD)
+    # ...and repeated provider/model strings on every row
+    if "provider" in columns:
+        _migrate_to_model_ids(c, "api_usage", API_USAGE_COLUMNS)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_api_usage_model_time ON api_usage (model_id, timestamp)")
+
+    # Raw prompt/response text, only written when LLMSCOPE_STORE_TEXT is on
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS usage_text (
+            usage_id INTEGER PRIMARY KEY REFERENCES api_usage(id),
+            prompt TEXT,
+            response TEXT
+        )
+    """)
+
+    # Daily aggregates per provider/model, kept up to date on ingest so
+    # reporting endpoints never have to scan api_usage
+    has_rollup = c.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'usage_daily'"
+    ).fetchone()
+    c.execute(f"CREATE TABLE IF NOT EXISTS usage_daily ({USAGE_DAILY_COLUMNS})")
+    if not has_rollup:
+        # Backfill from rows logged before the rollup existed
+        c.execute("""
+            INSERT INTO usage_daily (day, model_id, request_count, total_tokens, total_cost_micros)
+            SELECT substr(timestamp, 1, 10), model_id, COUNT(*),
+                   COALESCE(SUM(total_tokens), 0), COALESCE(SUM(cost_micros), 0)
+            FROM api_usage
+            GROUP BY substr(timestamp, 1, 10), model_id
+        """)
+    else:
+        columns = {row[1] for row in c.execute("PRAGMA table_info(usage_daily)")}
+        if "total_cost" in columns:
+            _migrate_to_micros(c, "usage_daily", "total_cost", "total_cost_micros", MICROS_PER_USD)
+        if "provider" in columns:
+            _migrate_to_model_ids(c, "usage_daily", USAGE_DAILY_COLUMNS)
+
+def create_pricing_table(c):
+    """Create (or migrate) model_pricing; prices are integer micro-dollars per 1M tokens."""
+    create_models_table(c)
+    c.execute(f"CREATE TABLE IF NOT EXISTS model_pricing ({MODEL_PRICING_COLUMNS})")
+
+    # Databases created before integer pricing stored REAL dollars per 1K tokens
+    columns = {row[1] for row in c.execute("PRAGMA table_info(model_pricing)")}
+    if "input_cost_per_1k" in columns:
+        _migrate_to_micros(c, "model_pricing", "input_cost_per_1k", "input_micros_per_1m", PER_1K_TO_MICROS_PER_1M)
+        _migrate_to_micros(c, "model_pricing", "output_cost_per_1k", "output_micros_per_1m", PER_1K_TO_MICROS_PER_1M)
+    if "provider" in columns:
+        _migrate_to_model_ids(c, "model_pricing", MODEL_PRICING_COLUMNS)
+
+def _migrate_to_micros(c, table, old_column, new_column, scale):
+    """Replace a REAL dollar column with its integer micro-dollar equivalent.
+
+    Safe to re-run after an interrupted migration left both columns behind.
+    """
+    if new_column not in {row[1] for row in c.execute(f"PRAGMA table_info({table})")}:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {new_column} INTEGER NOT NULL DEFAULT 0")
+    c.execute(f"UPDATE {table} SET {new_column} = CAST(ROUND(COALESCE({old_column}, 0) * {scale}) AS INTEGER)")
+    c.execute(f"ALTER TABLE {table} DROP COLUMN {old_column}")
+
+def _migrate_to_model_ids(c, table, columns):
+    """Rebuild a table that stored provider/model strings to reference models(id).
+
+    Follows SQLite's create-copy-drop-rename procedure, so foreign keys that
+    point at the table (usage_text -> api_usage) keep their target name.
+    """
+    new = f"{table}_new"
+    c.execute(f"INSERT OR IGNORE INTO models (provider, model) SELECT DISTINCT provider, model FROM {table}")
+    c.execute(f"CREATE TABLE {new} ({columns})")
+
+    kept = [row[1] for row in c.execute(f"PRAGMA table_info({new})") if row[1] != "model_id"]
+    c.execute(f"""
+        INSERT INTO {new} (model_id, {", ".join(kept)})
+        SELECT m.id, {", ".join(f"t.{name}" for name in kept)}
+        FROM {table} t JOIN models m ON m.provider = t.provider AND m.model = t.model
+    """)
+    c.execute(f"DROP TABLE {table}")
+    c.execute(f"ALTER TABLE {new} RENAME TO {table}")
+
+
+# Per-tenant shard files, opened on demand
+tenant_shards = shards.ShardManager(shards.TENANTS_DIR, create_usage_tables)
+
+# ============================================================================
+# CROSS-PROCESS CACHE INVALIDATION
+# ============================================================================
+
+def _stamp_path(db_path):
+    return f"{db_path}.gen"
+
+def bump_cache_generation(db_path=DATABASE_PATH):
+    """Tell every process that pricing or settings changed.
+
+    The stamp file is replaced atomically, so its (inode, mtime) pair changes
+    even on filesystems with coarse timestamps.
+    """
+    path = _stamp_path(db_path)
+    tmp = f"{path}.{os.getpid()}.{uuid.uuid4().hex}"
+    with open(tmp, "w") as f:
+        f.write(uuid.uuid4().hex)
+    os.replace(tmp, path)
+
+def cache_generation(db_path=DATABASE_PATH):
+    """Return a token that changes whenever bump_cache_generation() runs."""
+    try:
+        st = os.stat(_stamp_path(db_path))
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns)
+
+# ============================================================================
+# WRITE OPERATIONS
+# ============================================================================
+
+class ModelIds:
+    """In-memory (provider, model) -> models.id map for one database.
+
+    Ingest resolves every record through here, so the models table is only
+    touched the first time a name is seen. Call clear() after a rollback: an
+    ID interned by the rolled-back work may be handed out again.
+    """
+
+    def __init__(self, max_size=MODEL_ID_CACHE_SIZE):
+        self.max_size = max_size
+        self._ids = {}
+
+    def get(self, conn, provider, model):
+        key = (provider, model)
+        model_id = self._ids.get(key)
+        if model_id is None:
+            conn.execute("INSERT OR IGNORE INTO models (provider, model) VALUES (?, ?)", key)
+            model_id = conn.execute(
+                "SELECT id FROM models WHERE provider = ? AND model = ?", key
+            ).fetchone()[0]
+            if len(self._ids) >= self.max_size:
+                self._ids.clear()
+            self._ids[key] = model_id
+        return model_id
+
+    def clear(self):
+        self._ids.clear()
+
+# One ID map per database file (the main database and each tenant shard)
+_model_ids = {}
+
+def model_ids_for(db_path):
+    if db_path not in _model_ids:
+        _model_ids[db_path] = ModelIds()
+    return _model_ids[db_path]
+
+class RawSampler:
+    """Decide which raw usage rows to keep, per provider/model.
+
+    Rows are kept at `rate`, except errors, rows costing at least `keep_cost`
+    and rows costing more than `outlier_factor` times the running mean for
+    their provider/model, which are always kept.
+    """
+
+    def __init__(self, rate=RAW_SAMPLE_RATE, keep_cost=RAW_KEEP_COST_USD, outlier_factor=RAW_OUTLIER_FACTOR):
+        self.rate = rate
+        self.keep_cost = round(keep_cost * MICROS_PER_USD)
+        self.outlier_factor = outlier_factor
+        self._mean_cost = {}  # (provider, model) -> exponentially weighted mean
+
+    def sample(self, record):
+        """Return the probability the row was kept with, or None to drop it."""
+        if self.rate >= 1:
+            return 1.0
+
+        key = (record["provider"], record["model"])
+        cost = record["cost_micros"]
+        mean = self._mean_cost.get(key)
+        self._mean_cost[key] = cost if mean is None else mean + 0.05 * (cost - mean)
+
+        if record.get("is_error"):
+            return 1.0
+        if self.keep_cost and cost >= self.keep_cost:
+            return 1.0
+        if mean and cost > self.outlier_factor * mean:
+            return 1.0
+        return self.rate if random.random() < self.rate else None
+
+raw_sampler = RawSampler()
+
+def write_usage(conn, record, model_ids=None, rollups=None):
+    """Store the raw row if sampled and add the record to the daily aggregates.
+
+    With `rollups`, the aggregate update is deferred to rollups.flush() so a
+    batch costs one usage_daily UPSERT per day and model, not one per record.
+    """
+    model_id = (model_ids or ModelIds()).get(conn, record["provider"], record["model"])
+
+    sample_rate = raw_sampler.sample(record)
+    if sample_rate is None:
+        result = {"id": None, "stored": False}
+    else:
+        cursor = conn.execute("""
+            INSERT INTO api_usage
+            (model_id, timestamp, prompt_tokens, completion_tokens, total_tokens, cost_micros, request_id, metadata, sample_rate)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            model_id,
+            record["timestamp"],
+            record["prompt_tokens"],
+            record["completion_tokens"],
+            record["prompt_tokens"] + record["completion_tokens"],
+            record["cost_micros"],
+            record.get("request_id"),
+            json.dumps(record.get("metadata", {})),
+            sample_rate
+        ))
+        if "text" in record:
+            conn.execute(
+                "INSERT INTO usage_text (usage_id, prompt, response) VALUES (?, ?, ?)",
+                (cursor.lastrowid, record["text"]["prompt"], record["text"]["response"])
+            )
+        result = {"id": cursor.lastrowid, "stored": True}
+
+    # Last, so a record that failed above never reaches the aggregates
+    if rollups is None:
+        update_rollups(conn, record, model_id)
+    else:
+        rollups.add(record, model_id)
+    return result
+
+class Rollups:
+    """Daily aggregate deltas for one transaction, keyed by (day, model_id)."""
+
+    def __init__(self):
+        self._deltas = {}
+
+    def add(self, record, model_id):
+        delta = self._deltas.setdefault((record["timestamp"][:10], model_id), [0, 0, 0])
+        delta[0] += 1
+        delta[1] += record["prompt_tokens"] + record["completion_tokens"]
+        delta[2] += record["cost_micros"]
+
+    def flush(self, conn):
+        """Write the accumulated deltas; call inside the batch's transaction."""
+        conn.executemany(UPSERT_ROLLUP, [
+            (day, model_id, count, tokens, cost)
+            for (day, model_id), (count, tokens, cost) in self._deltas.items()
+        ])
+        self._deltas.clear()
+
+UPSERT_ROLLUP = """
+    INSERT INTO usage_daily (day, model_id, request_count, total_tokens, total_cost_micros)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(day, model_id) DO UPDATE SET
+        request_count = request_count + excluded.request_count,
+        total_tokens = total_tokens + excluded.total_tokens,
+        total_cost_micros = total_cost_micros + excluded.total_cost_micros
+"""
+
+def update_rollups(conn, record, model_id):
+    """Add one usage record to the daily aggregates."""
+    conn.execute(UPSERT_ROLLUP, (
+        record["timestamp"][:10],
+        model_id,
+        1,
+        record["prompt_tokens"] + record["completion_tokens"],
+        record["cost_micros"]
+    ))
+
+def _write_pricing(conn, rows, model_ids):
+    for row in rows:
+        conn.execute("""
+            INSERT INTO model_pricing (model_id, input_micros_per_1m, output_micros_per_1m, last_updated)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(model_id) DO UPDATE SET
+                input_micros_per_1m = excluded.input_micros_per_1m,
+                output_micros_per_1m = excluded.output_micros_per_1m,
+                last_updated = excluded.last_updated
+        """, (model_ids.get(conn, row["provider"], row["model"]), row["input_micros_per_1m"],
+              row["output_micros_per_1m"], row["last_updated"]))
+    return {"count": len(rows)}
+
+def _write_aliases(conn, rows, model_ids):
+    for row in rows:
+        conn.execute(
+            "INSERT OR REPLACE INTO model_aliases (provider, alias, model) VALUES (?, ?, ?)",
+            (row["provider"], row["alias"], row["model"])
+        )
+    return {"count": len(rows)}
+
+def _write_settings(conn, data, model_ids):
+    for key, value in data["values"].items():
+        conn.execute(
+            "INSERT OR REPLACE INTO settings (key, value, updated_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), data["updated_at"])
+        )
+    return {"count": len(data["values"])}
+
+WRITE_OPS = {
+    "usage": write_usage,
+    "pricing": _write_pricing,
+    "aliases": _write_aliases,
+    "settings": _write_settings,
+}
+
+def _apply_in_transaction(conn, batch, model_ids):
+    """Apply (op, data) pairs in one transaction on one database.
+
+    Each write runs in its own savepoint so a bad record is rejected without
+    discarding the rest of the batch. Usage records share one set of rollup
+    deltas, written just before COMMIT. Returns one (ok, result) pair per write.
+    """
+    results = []
+    rollups = Rollups()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for op, data in batch:
+            handler = WRITE_OPS.get(op)
+            if handler is None:
+                results.append((False, f"Unknown write op: {op}"))
+                continue
+            conn.execute("SAVEPOINT item")
+            try:
+                if op == "usage":
+                    results.append((True, handler(conn, data, model_ids, rollups)))
+                else:
+                    results.append((True, handler(conn, data, model_ids)))
+                conn.execute("RELEASE item")
+            except Exception as e:
+                conn.execute("ROLLBACK TO item")
+                conn.execute("RELEASE item")
+                model_ids.clear()
+                results.append((False, str(e)))
+        rollups.flush(conn)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        model_ids.clear()
+        raise
+    return results
+
+def apply_batch(conn, batch, db_path=DATABASE_PATH):
+    """Apply (op, data) pairs with one transaction per target database.
+
+    Usage records that carry a "tenant" go to that tenant's shard; everything
+    else goes to conn. Returns one (ok, result) pair per write, in order.
+    """
+    groups = {}
+    for i, (op, data) in enumerate(batch):
+        tenant = data.get("tenant") if op == "usage" else None
+        groups.setdefault(tenant, []).append(i)
+
+    results = [None] * len(batch)
+    for tenant, indices in groups.items():
+        writes = [batch[i] for i in indices]
+        try:
+            if tenant is None:
+                group_results = _apply_in_transaction(conn, writes, model_ids_for(db_path))
+            else:
+                with tenant_shards.connect(tenant, create=True) as shard_conn:
+                    group_results = _apply_in_transaction(
+                        shard_conn, writes, model_ids_for(tenant_shards.path(tenant))
+                    )
+        except Exception as e:
+            group_results = [(False, f"Database error: {e}")] * len(writes)
+        for i, result in zip(indices, group_results):
+            results[i] = result
+
+    if any(ok and op in INVALIDATING_OPS for (op, _), (ok, _) in zip(batch, results)):
+        bump_cache_generation(db_path)
+    for (op, data), (ok, _) in zip(batch, results):
+        if ok and op == "usage":
+            heavy_hitters.add(data.get("metadata"), data["cost_micros"], tenant=data.get("tenant"))
+    return results
+
+def top_costs(data):
+    """Top values of one key and window, over the requested tenants.
+
+    Returns None when that key/window pair is not tracked at all.
+    """
+    key, window = data["key"], data["window"]
+    if not heavy_hitters.tracks(key, window):
+        return None
+    return heavy_hitters.top(key, window, data["k"], tenants=data["tenants"])
+
+# Read-only requests answered by the writer from its in-memory state
+QUERY_OPS = {
+    "top": top_costs,
+}
+
+# ============================================================================
+# WRITER SERVER
+# ============================================================================
+
+class WriterServer:
+    """Accept writes from API workers and commit them in batches."""
+
+    def __init__(self, db_path=DATABASE_PATH, socket_path=WRITER_SOCKET, max_batch=MAX_BATCH):
+        self.db_path = db_path
+        self.socket_path = socket_path
+        self.max_batch = max_batch
+        # A single thread owns the connection; the event loop stays free to
+        # read more records while a batch commits.
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._queue = None
+        self._conn = None
+
+    async def serve_forever(self):
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._conn = await loop.run_in_executor(self._executor, connect, self.db_path)
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(
+            self._handle_client, path=self.socket_path, limit=STREAM_LIMIT
+        )
+        print(f"✓ Writer listening on {self.socket_path}")
+        async with server:
+            await asyncio.gather(server.serve_forever(), self._drain())
+
+    async def _handle_client(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                msg = json.loads(line)
+                query = QUERY_OPS.get(msg.get("op"))
+                if query is None:
+                    await self._queue.put((msg, writer))
+                    continue
+                try:
+                    # Queries read state that apply_batch mutates, so they run
+                    # on the same single writer thread
+                    result = await asyncio.get_running_loop().run_in_executor(
+                        self._executor, query, msg.get("data")
+                    )
+                    reply = {"id": msg.get("id"), "ok": True, "result": result}
+                except Exception as e:
+                    reply = {"id": msg.get("id"), "ok": False, "error": str(e)}
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            writes = [(msg.get("op"), msg.get("data")) for msg, _ in batch]
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, apply_batch, self._conn, writes, self.db_path
+                )
+            except Exception as e:
+                results = [(False, f"Database error: {e}")] * len(batch)
+
+            clients = set()
+            for (msg, client), (ok, value) in zip(batch, results):
+                reply = {"id": msg.get("id"), "ok": ok}
+                reply["result" if ok else "error"] = value
+                if not client.is_closing():
+                    client.write(json.dumps(reply).encode() + b"\n")
+                    clients.add(client)
+            for client in clients:
+                try:
+                    await client.drain()
+                except ConnectionError:
+                    pass
+
+# ============================================================================
+# SINGLE-PROCESS WRITER
+# ============================================================================
+
+class LocalWriter:
+    """Batch writes inside a single-worker server, as the writer process does.
+
+    Same submit() interface as WriterClient. Concurrent requests are queued
+    and committed together on one thread that owns a synchronous=NORMAL
+    connection, instead of one connection and transaction per record.
+    """
+
+    def __init__(self, db_path=DATABASE_PATH, max_batch=MAX_BATCH):
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._conn = None
+        self._queue = None
+        self._task = None
+
+    async def start(self):
+        """Open the connection and start batching; call once from the event loop."""
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._conn = await loop.run_in_executor(self._executor, connect, self.db_path)
+        self._task = asyncio.create_task(self._drain())
+
+    async def submit(self, op, data):
+        """Apply one write (or answer a query) and return its result."""
+        loop = asyncio.get_running_loop()
+        query = QUERY_OPS.get(op)
+        if query is not None:
+            # Queries read state that apply_batch mutates on the writer thread
+            return await loop.run_in_executor(self._executor, query, data)
+
+        future = loop.create_future()
+        await self._queue.put((op, data, future))
+        ok, result = await future
+        if not ok:
+            raise WriterError(result)
+        return result
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            writes = [(op, data) for op, data, _ in batch]
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, apply_batch, self._conn, writes, self.db_path
+                )
+            except Exception as e:
+                results = [(False, f"Database error: {e}")] * len(batch)
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def close(self):
+        """Stop batching once queued writes are committed, and close the connection."""
+        if self._task is None:
+            return
+        while not self._queue.empty():
+            await asyncio.sleep(0.01)
+        self._task.cancel()
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._conn.close)
+        self._executor.shutdown()
+
+# ============================================================================
+# WORKER-SIDE CLIENT
+# ============================================================================
+
+class WriterClient:
+    """Pipelined connection from an API worker to the writer process."""
+
+    def __init__(self, socket_path=WRITER_SOCKET, connect_timeout=10):
+        self.socket_path = socket_path
+        self.connect_timeout = connect_timeout
+        self._ids = itertools.count()
+        self._pending = {}
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    async def _connect(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.connect_timeout
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(
+                    self.socket_path, limit=STREAM_LIMIT
+                )
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                # The writer may still be starting up
+                if loop.time() >= deadline:
+                    raise
+                await asyncio.sleep(0.1)
+        asyncio.create_task(self._read_replies(reader, self._writer))
+
+    async def _read_replies(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                reply = json.loads(line)
+                future = self._pending.pop(reply.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(reply)
+        finally:
+            if self._writer is writer:
+                self._writer = None
+            pending, self._pending = self._pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Writer connection lost"))
+
+    async def submit(self, op, data):
+        """Send one write (or query) and wait until the writer answers."""
+        async with self._lock:
+            if self._writer is None:
+                await self._connect()
+            request_id = next(self._ids)
+            future = asyncio.get_running_loop().create_future()
+            self._pending[request_id] = future
+            self._writer.write(json.dumps({"id": request_id, "op": op, "data": data}).encode() + b"\n")
+            await self._writer.drain()
+
+        reply = await asyncio.wait_for(future, SUBMIT_TIMEOUT_S)
+        if not reply["ok"]:
+            raise WriterError(reply["error"])
+        return reply["result"]
+
+
+def run(db_path=DATABASE_PATH, socket_path=WRITER_SOCKET):
+    """Run the writer until interrupted."""
+    try:
+        asyncio.run(WriterServer(db_path, socket_path).serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    if not WRITER_SOCKET:
+        raise SystemExit("Set LLMSCOPE_WRITER_SOCKET to the Unix socket path to listen on")
+
+    from app import init_db
+    init_db()
+    run()